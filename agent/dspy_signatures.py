@@ -1,9 +1,14 @@
-import json
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List
+from typing import Dict, List
 from types import SimpleNamespace
 
 import dspy
+import orjson
 
 MODEL_NAME = "ollama/phi3.5:3.8b-mini-instruct-q4_K_M"
 dspy.configure(lm=dspy.LM(MODEL_NAME))
@@ -58,8 +63,16 @@ ROUTER_DATASET = [
 
 ARTIFACT_DIR = Path("artifacts")
 ARTIFACT_DIR.mkdir(exist_ok=True)
-PROGRAM_PATH = ARTIFACT_DIR / "router_program.json"
+_ROUTER_FINGERPRINT = hashlib.sha256(
+    orjson.dumps({"model": MODEL_NAME, "dataset": ROUTER_DATASET}, option=orjson.OPT_SORT_KEYS)
+).hexdigest()[:8]
+PROGRAM_PATH = ARTIFACT_DIR / f"router_program_{_ROUTER_FINGERPRINT}.json"
 METRICS_PATH = ARTIFACT_DIR / "router_metrics.json"
+ROUTER_CACHE_PATH = ARTIFACT_DIR / "router_cache.json"
+ROUTER_CACHE_SIZE = 1024
+ROUTES = {"rag", "sql", "hybrid"}
+UNCOMPILED_TAG = "uncompiled"
+EVAL_THREADS = 8
 
 
 def _router_metric(example: dspy.Example, pred: dspy.Prediction, trace=None) -> float:
@@ -72,6 +85,14 @@ def _build_trainset() -> List[dspy.Example]:
     return [dspy.Example(**row).with_inputs("question") for row in ROUTER_DATASET]
 
 
+def _program_tag(state: str) -> str:
+    return f"{_ROUTER_FINGERPRINT}:{state}"
+
+
+def _cache_key(question: str) -> str:
+    return " ".join(question.strip().lower().split())
+
+
 class RouterModule(dspy.Module):
     """DSPy-powered router with optimizer + graceful degradation."""
 
@@ -79,9 +100,29 @@ class RouterModule(dspy.Module):
         super().__init__()
         self.predictor = dspy.Predict(RouterSignature)
         self.optimized = False
-        self._compile_with_optimizer()
+        self.program_tag = _program_tag(UNCOMPILED_TAG)
+        self._route_cache_lock = threading.Lock()
+        self._route_cache_dirty = False
+        self._route_flush_lock = threading.Lock()
+        if not self._load_compiled_program():
+            self._compile_with_optimizer()
+        self._route_cache = self._load_route_cache()
+
+    def _load_compiled_program(self) -> bool:
+        """Reuse a program compiled for the same model and trainset, if present."""
+        if not PROGRAM_PATH.exists():
+            return False
+        try:
+            raw = PROGRAM_PATH.read_bytes()
+            self.predictor.load(str(PROGRAM_PATH))
+        except Exception:
+            return False
+        self.optimized = True
+        self.program_tag = _program_tag(hashlib.sha256(raw).hexdigest())
+        return True
 
     def _compile_with_optimizer(self):
+        self._reset_route_cache()
         trainset = _build_trainset()
         optimizer = dspy.BootstrapFewShot(metric=_router_metric)
         try:
@@ -90,15 +131,35 @@ class RouterModule(dspy.Module):
                 trainset=trainset,
             )
             self.optimized = True
+            self.program_tag = self._unsaved_program_tag()
             metrics = {
                 "metric": "accuracy",
                 "before": self._evaluate_baseline(trainset),
                 "after": self._evaluate_model(trainset),
             }
-            METRICS_PATH.write_text(json.dumps(metrics, indent=2), encoding="utf-8")
+            METRICS_PATH.write_bytes(orjson.dumps(metrics, option=orjson.OPT_INDENT_2))
+            # BootstrapFewShot swallows LM errors, so an unreachable model still "compiles";
+            # only persist programs that actually learned demos and beat the baseline.
+            if getattr(self.predictor, "demos", None) and metrics["after"] > metrics["before"]:
+                self._save_compiled_program()
         except Exception:
             self.optimized = False
 
+    def _save_compiled_program(self):
+        try:
+            self.predictor.save(str(PROGRAM_PATH))
+            self.program_tag = _program_tag(hashlib.sha256(PROGRAM_PATH.read_bytes()).hexdigest())
+        except Exception:
+            pass
+
+    def _unsaved_program_tag(self) -> str:
+        """Tag an in-memory program by its dumped state (demos etc.) when it was not persisted."""
+        try:
+            state = orjson.dumps(self.predictor.dump_state(), default=str, option=orjson.OPT_SORT_KEYS)
+        except Exception:
+            return _program_tag(UNCOMPILED_TAG)
+        return _program_tag("unsaved-" + hashlib.sha256(state).hexdigest())
+
     def _evaluate_baseline(self, dataset: List[dspy.Example]) -> float:
         majority = "rag"
         correct = sum(1 for example in dataset if example.route == majority)
@@ -106,11 +167,13 @@ class RouterModule(dspy.Module):
 
     def _evaluate_model(self, dataset: List[dspy.Example]) -> float:
         try:
-            correct = 0
-            for example in dataset:
-                pred = self.predictor(question=example.question)
-                if (pred.route or "").strip().lower() == example.route.strip().lower():
-                    correct += 1
+            with ThreadPoolExecutor(max_workers=EVAL_THREADS) as pool:
+                preds = list(pool.map(lambda example: self.predictor(question=example.question), dataset))
+            correct = sum(
+                1
+                for example, pred in zip(dataset, preds)
+                if (pred.route or "").strip().lower() == example.route.strip().lower()
+            )
             return correct / max(len(dataset), 1)
         except Exception:
             return 0.0
@@ -123,9 +186,84 @@ class RouterModule(dspy.Module):
             return "sql"
         return "hybrid"
 
+    def _load_route_cache(self) -> "OrderedDict[str, str]":
+        """Load cached LM routes, discarding them unless they came from the current program state."""
+        try:
+            payload = orjson.loads(ROUTER_CACHE_PATH.read_bytes())
+        except (OSError, ValueError):
+            return OrderedDict()
+        if not isinstance(payload, dict) or payload.get("program") != self.program_tag:
+            return OrderedDict()
+        routes = payload.get("routes")
+        if not isinstance(routes, dict):
+            return OrderedDict()
+        return OrderedDict((key, route) for key, route in routes.items() if route in ROUTES)
+
+    def _reset_route_cache(self):
+        """Drop cached routes; they came from a program this compile replaces."""
+        with self._route_cache_lock:
+            self._route_cache = OrderedDict()
+            self._route_cache_dirty = False
+        try:
+            ROUTER_CACHE_PATH.unlink(missing_ok=True)
+        except OSError:
+            pass
+
+    def _lookup_route(self, key: str):
+        with self._route_cache_lock:
+            route = self._route_cache.get(key)
+            if route is not None:
+                self._route_cache.move_to_end(key)
+        return route
+
+    def _remember_route(self, key: str, route: str):
+        with self._route_cache_lock:
+            self._route_cache[key] = route
+            self._route_cache.move_to_end(key)
+            while len(self._route_cache) > ROUTER_CACHE_SIZE:
+                self._route_cache.popitem(last=False)
+            self._route_cache_dirty = True
+        self._flush_route_cache()
+
+    def _flush_route_cache(self):
+        """Write the cache outside the cache lock; one thread drains updates while others move on."""
+        while True:
+            if not self._route_flush_lock.acquire(blocking=False):
+                return
+            try:
+                while True:
+                    with self._route_cache_lock:
+                        if not self._route_cache_dirty:
+                            break
+                        self._route_cache_dirty = False
+                        routes = dict(self._route_cache)
+                    self._write_route_cache(routes)
+            finally:
+                self._route_flush_lock.release()
+            with self._route_cache_lock:
+                if not self._route_cache_dirty:
+                    return
+
+    def _write_route_cache(self, routes: Dict[str, str]):
+        payload = {"program": self.program_tag, "routes": routes}
+        tmp_path = ROUTER_CACHE_PATH.with_name(f"{ROUTER_CACHE_PATH.name}.{os.getpid()}.tmp")
+        try:
+            tmp_path.write_bytes(orjson.dumps(payload, option=orjson.OPT_INDENT_2))
+            os.replace(tmp_path, ROUTER_CACHE_PATH)
+        except OSError:
+            pass
+
     def forward(self, question):
+        key = _cache_key(question)
+        cached = self._lookup_route(key)
+        if cached:
+            return SimpleNamespace(route=cached)
         try:
-            return self.predictor(question=question)
+            pred = self.predictor(question=question)
         except Exception:
             heuristic_route = self._heuristic_predict(question)
-            return SimpleNamespace(route=heuristic_route)
\ No newline at end of file
+            return SimpleNamespace(route=heuristic_route, fallback=True)
+        route = (pred.route or "").strip().lower()
+        if route in ROUTES:
+            self._remember_route(key, route)
+        return pred
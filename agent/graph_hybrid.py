@@ -1,7 +1,10 @@
+import functools
 import re
-from dataclasses import dataclass
-from datetime import datetime
-from typing import Dict, Any, List, Optional, Tuple, Iterable
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, Dict, Any, List, Mapping, Optional, Set, Tuple, Iterable
+
+import ahocorasick
 
 from agent.rag.retrieval import Retriever
 from agent.tools.sqlite_tool import SQLiteTool
@@ -18,6 +21,50 @@ KNOWN_CATEGORIES = [
     "Produce",
     "Seafood",
 ]
+_KNOWN_CATEGORIES_LOWER = [(cat, cat.lower()) for cat in KNOWN_CATEGORIES]
+_POLICY_HINTS = [cat_lc for _, cat_lc in _KNOWN_CATEGORIES_LOWER] + ["beverages", "condiments", "policy", "return"]
+
+SQL_SIGNALS = ["top", "revenue", "aov", "average order value", "margin", "quantity", "customer"]
+DOC_SIGNALS = ["policy", "return window", "returns policy", "docs", "definition"]
+KPI_KEYWORDS = {
+    "aov": "aov",
+    "average order value": "aov",
+    "gross margin": "gross_margin",
+    "margin": "gross_margin",
+    "revenue": "revenue",
+}
+_KPI_PRIORITY = ["aov", "gross_margin", "revenue"]
+_KEYWORD_CLASSES = ("category", "sql_signal", "doc_signal", "kpi")
+
+_DATE_RANGE_RE = re.compile(r"(\d{4}-\d{2}-\d{2})\s*(?:to|–|-)\s*(\d{4}-\d{2}-\d{2})")
+_TOP_N_RE = re.compile(r"top\s+(\d+)", re.IGNORECASE)
+_DAYS_RE = re.compile(r"(\d+)\s*days", re.IGNORECASE)
+_TABLE_RE = re.compile(r'\bFROM\s+"?([\w\s]+)"?|\bJOIN\s+"?([\w\s]+)"?', re.IGNORECASE)
+_WS_RE = re.compile(r"\s+")
+_UNBOUND = object()
+_PLACEHOLDER_RE = re.compile(r"'(?:[^']|'')*'|\"(?:[^\"]|\"\")*\"|\?")
+
+
+@dataclass
+class ChunkBundle:
+    """Retrieved chunks as parallel lists, with lowercased text computed once."""
+
+    ids: List[str] = field(default_factory=list)
+    contents: List[str] = field(default_factory=list)
+    contents_lower: List[str] = field(default_factory=list)
+
+    @classmethod
+    def from_results(cls, results: Iterable[Dict[str, Any]]) -> "ChunkBundle":
+        bundle = cls()
+        for result in results:
+            content = result.get("content", "")
+            bundle.ids.append(result.get("chunk_id"))
+            bundle.contents.append(content)
+            bundle.contents_lower.append(content.lower())
+        return bundle
+
+    def __len__(self) -> int:
+        return len(self.ids)
 
 
 def safe_round_float(val: Any, ndigits: int = 2) -> float:
@@ -27,111 +74,201 @@ def safe_round_float(val: Any, ndigits: int = 2) -> float:
         return float("nan")
 
 
+def _format_value(value: Any) -> Any:
+    if isinstance(value, float):
+        return safe_round_float(value, 2)
+    if isinstance(value, int):
+        return int(value)
+    return value
+
+
+def _format_float(value: Any) -> Any:
+    return safe_round_float(value, 2) if type(value) is float else _format_value(value)
+
+
+def _format_int(value: Any) -> Any:
+    return value if type(value) is int else _format_value(value)
+
+
+def _format_text(value: Any) -> Any:
+    return value if type(value) is str else _format_value(value)
+
+
+def build_row_formatter(row: Dict[str, Any]) -> List[Tuple[str, str, Callable[[Any], Any]]]:
+    """Pick one formatter per column from the first row's value types.
+
+    SQLite types each value separately, so every formatter falls back to
+    ``_format_value`` when a later row holds a different type.
+    """
+    specs = []
+    for key, value in row.items():
+        if isinstance(value, float):
+            fmt = _format_float
+        elif isinstance(value, int):
+            fmt = _format_int
+        elif isinstance(value, str):
+            fmt = _format_text
+        else:
+            fmt = _format_value
+        specs.append((key, key.lower(), fmt))
+    return specs
+
+
 def normalize_category(value: Optional[str]) -> Optional[str]:
     if not value:
         return None
-    for cat in KNOWN_CATEGORIES:
-        if cat.lower() in value.lower():
+    value_lc = value.lower()
+    for cat, cat_lc in _KNOWN_CATEGORIES_LOWER:
+        if cat_lc in value_lc:
             return cat
     return value
 
 
-def extract_first_date_range(text: str) -> Optional[Tuple[str, str]]:
+def extract_first_date_range(text: str, text_lower: Optional[str] = None) -> Optional[Tuple[str, str]]:
     if not text:
         return None
-    range_pattern = re.compile(r"(\d{4}-\d{2}-\d{2})\s*(?:to|–|-)\s*(\d{4}-\d{2}-\d{2})")
-    match = range_pattern.search(text)
+    match = _DATE_RANGE_RE.search(text)
     if match:
         return match.group(1), match.group(2)
-    if "summer beverages 1997" in text.lower():
+    if text_lower is None:
+        text_lower = text.lower()
+    if "summer beverages 1997" in text_lower:
         return "1997-06-01", "1997-06-30"
-    if "winter classics 1997" in text.lower():
+    if "winter classics 1997" in text_lower:
         return "1997-12-01", "1997-12-31"
     return None
 
 
-def extract_date_range(question: str, chunks: List[Dict[str, Any]]) -> Optional[Tuple[str, str]]:
-    check_targets = [question] + [c.get("content", "") for c in chunks]
-    for text in check_targets:
-        dr = extract_first_date_range(text)
+def extract_date_range(question: str, chunks: ChunkBundle) -> Optional[Tuple[str, str]]:
+    dr = extract_first_date_range(question)
+    if dr:
+        return dr
+    for content, content_lower in zip(chunks.contents, chunks.contents_lower):
+        dr = extract_first_date_range(content, content_lower)
         if dr:
             return dr
     return None
 
 
-def extract_category(question: str, chunks: List[Dict[str, Any]]) -> Optional[str]:
-    q = question.lower()
+def build_keyword_automaton() -> ahocorasick.Automaton:
+    tags: Dict[str, List[Tuple[str, str]]] = {}
+    for cat, cat_lc in _KNOWN_CATEGORIES_LOWER:
+        tags.setdefault(cat_lc, []).append(("category", cat))
+    for word in SQL_SIGNALS:
+        tags.setdefault(word, []).append(("sql_signal", word))
+    for word in DOC_SIGNALS:
+        tags.setdefault(word, []).append(("doc_signal", word))
+    for word, kpi in KPI_KEYWORDS.items():
+        tags.setdefault(word, []).append(("kpi", kpi))
+
+    automaton = ahocorasick.Automaton()
+    for word, word_tags in tags.items():
+        automaton.add_word(word, tuple(word_tags))
+    automaton.make_automaton()
+    return automaton
+
+
+def scan_keywords(automaton: ahocorasick.Automaton, text: str) -> Dict[str, Set[str]]:
+    return _scan_lowered(automaton, text.lower())
+
+
+def _scan_lowered(automaton: ahocorasick.Automaton, text_lower: str) -> Dict[str, Set[str]]:
+    hits: Dict[str, Set[str]] = {kind: set() for kind in _KEYWORD_CLASSES}
+    for _, word_tags in automaton.iter(text_lower):
+        for kind, canonical in word_tags:
+            hits[kind].add(canonical)
+    return hits
+
+
+def _scan_categories(automaton: ahocorasick.Automaton, text_lower: str) -> Set[str]:
+    return {
+        canonical
+        for _, word_tags in automaton.iter(text_lower)
+        for kind, canonical in word_tags
+        if kind == "category"
+    }
+
+
+def _first_category(found: Set[str]) -> Optional[str]:
     for cat in KNOWN_CATEGORIES:
-        if cat.lower() in q:
+        if cat in found:
             return cat
-    for chunk in chunks:
-        content = chunk.get("content", "")
-        for cat in KNOWN_CATEGORIES:
-            if cat.lower() in content.lower():
-                return cat
+    return None
+
+
+def extract_category(
+    automaton: ahocorasick.Automaton,
+    question_hits: Dict[str, Set[str]],
+    chunks: ChunkBundle,
+) -> Optional[str]:
+    category = _first_category(question_hits["category"])
+    if category:
+        return category
+    for content_lower in chunks.contents_lower:
+        category = _first_category(_scan_categories(automaton, content_lower))
+        if category:
+            return category
     return None
 
 
 def parse_top_n(question: str) -> Optional[int]:
-    match = re.search(r"top\s+(\d+)", question.lower())
+    match = _TOP_N_RE.search(question)
     if match:
         return int(match.group(1))
     return None
 
 
-def sanitize_literal(value: str) -> str:
-    return value.replace("'", "''")
-
-
-def parse_format_hint(format_hint: str) -> Dict[str, Any]:
+@functools.lru_cache(maxsize=256)
+def parse_format_hint(format_hint: str) -> Mapping[str, Any]:
     hint = format_hint.strip()
     if hint == "int":
-        return {"type": "int"}
+        return MappingProxyType({"type": "int"})
     if hint.startswith("float"):
-        return {"type": "float"}
+        return MappingProxyType({"type": "float"})
     if hint.startswith("list"):
         inner = hint[len("list"):].strip()
-        return {"type": "list", "inner": parse_format_hint(inner[1:-1]) if inner.startswith("[") and inner.endswith("]") else {}}
+        inner_hint = parse_format_hint(inner[1:-1]) if inner.startswith("[") and inner.endswith("]") else MappingProxyType({})
+        return MappingProxyType({"type": "list", "inner": inner_hint})
     if hint.startswith("{") and hint.endswith("}"):
         fields = []
         for piece in hint[1:-1].split(","):
             if ":" in piece:
                 key, typ = piece.split(":", 1)
-                fields.append({"name": key.strip().strip("{} "), "type": typ.strip()})
-        return {"type": "object", "fields": fields}
-    return {"type": "str"}
+                fields.append(MappingProxyType({"name": key.strip().strip("{} "), "type": typ.strip()}))
+        return MappingProxyType({"type": "object", "fields": tuple(fields)})
+    return MappingProxyType({"type": "str"})
 
 
-def extract_policy_number(question: str, chunks: Iterable[Dict[str, Any]]) -> Optional[int]:
+@functools.lru_cache(maxsize=64)
+def _policy_patterns(hints: Tuple[str, ...]) -> Tuple[re.Pattern, re.Pattern]:
+    alternation = "|".join(re.escape(hint) for hint in hints)
+    hinted_days = re.compile(rf"^(?=[^\n]*(?:{alternation}))[^\n]*?(\d+)\s*days", re.IGNORECASE | re.MULTILINE)
+    return hinted_days, re.compile(alternation, re.IGNORECASE)
+
+
+def extract_policy_number(question: str, chunks: ChunkBundle) -> Optional[int]:
     question_lower = question.lower()
-    hints = []
-    for cat in KNOWN_CATEGORIES + ["beverages", "condiments", "policy", "return"]:
-        if cat.lower() in question_lower:
-            hints.append(cat.lower())
-
-    for chunk in chunks:
-        content = chunk.get("content", "")
-        lines = content.splitlines()
-        candidates = []
-        if hints:
-            for line in lines:
-                if any(hint in line.lower() for hint in hints):
-                    candidates.append(line)
-        if not candidates:
-            candidates = [content]
-        for text in candidates:
-            match = re.search(r"(\d+)\s*days", text, re.IGNORECASE)
+    hints = tuple(dict.fromkeys(hint for hint in _POLICY_HINTS if hint in question_lower))
+    hinted_days, hint_re = _policy_patterns(hints) if hints else (None, None)
+
+    for content in chunks.contents:
+        if hinted_days:
+            match = hinted_days.search(content)
             if match:
                 return int(match.group(1))
+            if hint_re.search(content):
+                continue
+        match = _DAYS_RE.search(content)
+        if match:
+            return int(match.group(1))
     return None
 
 
 def extract_tables_from_sql(sql: str) -> List[str]:
     if not sql:
         return []
-    table_pattern = re.compile(r'\bFROM\s+"?([\w\s]+)"?|\bJOIN\s+"?([\w\s]+)"?', re.IGNORECASE)
     tables = set()
-    for from_match, join_match in table_pattern.findall(sql):
+    for from_match, join_match in _TABLE_RE.findall(sql):
         candidate = from_match or join_match
         if not candidate:
             continue
@@ -141,12 +278,41 @@ def extract_tables_from_sql(sql: str) -> List[str]:
     return sorted(tables)
 
 
+def render_literal(value: Any) -> str:
+    if value is None:
+        return "NULL"
+    if isinstance(value, (int, float)):
+        return repr(value)
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+def render_sql(sql: str, params: Iterable[Any]) -> str:
+    """Inline bound parameters into the SQL text for output and auditing (never for execution)."""
+    values = iter(params)
+
+    def substitute(match: "re.Match[str]") -> str:
+        token = match.group()
+        if token != "?":
+            return token
+        value = next(values, _UNBOUND)
+        return token if value is _UNBOUND else render_literal(value)
+
+    return _PLACEHOLDER_RE.sub(substitute, sql) if sql else sql
+
+
 @dataclass
 class AgentArtifacts:
     tables: List[str]
     table_schemas: Dict[str, List[Dict[str, Any]]]
 
 
+@dataclass
+class GeneratedSQL:
+    sql: str = ""
+    params: Tuple[Any, ...] = ()
+    tables: List[str] = field(default_factory=list)
+
+
 class HybridAgent:
     """Orchestrates retrieval, planning, SQL generation/repair, and synthesis."""
 
@@ -161,52 +327,49 @@ class HybridAgent:
         self.retriever = retriever
         self.sqlite = sqlite_tool
         self.max_repairs = max_repairs
+        self.keyword_automaton = build_keyword_automaton()
 
         table_list = [t for t in self.sqlite.list_tables() if not t.lower().startswith("sqlite_")]
         table_schemas = {t: self.sqlite.get_table_schema(t) for t in table_list}
         self.artifacts = AgentArtifacts(tables=table_list, table_schemas=table_schemas)
         self.year_offset = self._compute_year_offset()
+        self._shifted_ranges: Dict[Tuple[str, str], Dict[str, str]] = {}
 
     def route(self, question: str) -> str:
-        fallback = self._fallback_route(question)
+        return self.resolve_route(question)[0]
+
+    def resolve_route(self, question: str) -> Tuple[str, bool]:
+        """Return the route and whether it came from a fallback because the LM gave no usable answer."""
+        fallback = self._fallback_route(scan_keywords(self.keyword_automaton, question))
         try:
             pred = self.router_module(question=question)
+            degraded = bool(getattr(pred, "fallback", False))
             route = (pred.route or fallback).strip().lower()
             if route not in {"rag", "sql", "hybrid"}:
-                return fallback
+                return fallback, True
             if route != fallback and fallback in {"sql", "hybrid"} and route == "rag":
-                return fallback
-            return route
+                return fallback, degraded
+            return route, degraded
         except Exception:
-            return fallback
-
-    def _fallback_route(self, question: str) -> str:
-        q = question.lower()
-        sql_signals = ["top", "revenue", "aov", "average order value", "margin", "quantity", "customer"]
-        doc_signals = ["policy", "return window", "returns policy", "docs", "definition"]
+            return fallback, True
 
-        if any(word in q for word in doc_signals) and not any(word in q for word in sql_signals):
+    def _fallback_route(self, hits: Dict[str, Set[str]]) -> str:
+        if hits["doc_signal"] and not hits["sql_signal"]:
             return "rag"
-        if any(word in q for word in sql_signals):
+        if hits["sql_signal"]:
             return "hybrid"
         return "rag"
 
-    def retrieve(self, question: str, top_k: int = 8) -> List[Dict[str, Any]]:
-        return self.retriever.search(question, top_k=top_k)
+    def retrieve(self, question: str, top_k: int = 8) -> ChunkBundle:
+        return ChunkBundle.from_results(self.retriever.search(question, top_k=top_k))
 
-    def plan(self, question: str, chunks: List[Dict[str, Any]]) -> Dict[str, Any]:
+    def plan(self, question: str, chunks: ChunkBundle) -> Dict[str, Any]:
+        hits = scan_keywords(self.keyword_automaton, question)
         date_range = extract_date_range(question, chunks)
-        category = extract_category(question, chunks)
+        category = extract_category(self.keyword_automaton, hits, chunks)
         normalized_category = normalize_category(category)
 
-        q = question.lower()
-        kpi = None
-        if "aov" in q or "average order value" in q:
-            kpi = "aov"
-        elif "gross margin" in q or "margin" in q:
-            kpi = "gross_margin"
-        elif "revenue" in q:
-            kpi = "revenue"
+        kpi = next((name for name in _KPI_PRIORITY if name in hits["kpi"]), None)
 
         plan = {}
         if date_range:
@@ -217,29 +380,31 @@ class HybridAgent:
             plan["kpi"] = kpi
         return plan
 
-    def generate_sql(self, question: str, constraints: Dict[str, Any]) -> str:
+    def generate_sql(self, question: str, constraints: Dict[str, Any]) -> GeneratedSQL:
         q = question.lower().strip()
         top_n = parse_top_n(question)
-        date_clause, where_clause = self._build_filters(constraints)
+        dr = self._get_sql_date_range(constraints)
+        where_clause, where_params = self._build_filters(dr)
         category = constraints.get("category")
 
         if "return window" in q or "return policy" in q:
-            return ""
+            return GeneratedSQL()
 
         if "top 3 products" in q or ("top" in q and "products" in q and "revenue" in q):
             limit_n = top_n or 3
-            return f"""
+            sql = """
                 SELECT p.ProductName AS product,
                        SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS revenue
                 FROM "Order Details" od
                 JOIN Products p ON p.ProductID = od.ProductID
                 GROUP BY p.ProductID
                 ORDER BY revenue DESC
-                LIMIT {limit_n};
+                LIMIT ?;
             """.strip()
+            return GeneratedSQL(sql, (limit_n,), ["Order Details", "Products"])
 
         if ("highest" in q or "top" in q) and "category" in q and "quantity" in q:
-            return f"""
+            sql = f"""
                 SELECT c.CategoryName AS category,
                        SUM(od.Quantity) AS quantity
                 FROM "Order Details" od
@@ -251,28 +416,29 @@ class HybridAgent:
                 ORDER BY quantity DESC
                 LIMIT 1;
             """.strip()
+            return GeneratedSQL(sql, where_params, ["Categories", "Order Details", "Orders", "Products"])
 
         if ("aov" in q or "average order value" in q):
-            return f"""
+            sql = f"""
                 SELECT SUM(od.UnitPrice * od.Quantity * (1 - od.Discount))
                        / COUNT(DISTINCT o.OrderID) AS aov
                 FROM "Order Details" od
                 JOIN Orders o ON o.OrderID = od.OrderID
                 {where_clause};
             """.strip()
+            return GeneratedSQL(sql, where_params, ["Order Details", "Orders"])
 
         if "total revenue" in q and category:
-            cat = sanitize_literal(category)
-            extra_filter = "c.CategoryName = '{cat}'".format(cat=cat)
             join_clause = "JOIN Categories c ON c.CategoryID = p.CategoryID"
 
-            where_parts = [extra_filter]
-            dr = self._get_sql_date_range(constraints)
+            where_parts = ["c.CategoryName = ?"]
+            params: List[Any] = [category]
             if dr:
-                where_parts.append(f"DATE(o.OrderDate) BETWEEN '{dr['start']}' AND '{dr['end']}'")
+                where_parts.append("DATE(o.OrderDate) BETWEEN ? AND ?")
+                params.extend([dr["start"], dr["end"]])
             where_sql = "WHERE " + " AND ".join(where_parts)
 
-            return f"""
+            sql = f"""
                 SELECT SUM(od.UnitPrice * od.Quantity * (1 - od.Discount)) AS revenue
                 FROM "Order Details" od
                 JOIN Orders o ON o.OrderID = od.OrderID
@@ -280,9 +446,10 @@ class HybridAgent:
                 {join_clause}
                 {where_sql};
             """.strip()
+            return GeneratedSQL(sql, tuple(params), ["Categories", "Order Details", "Orders", "Products"])
 
         if "gross margin" in q or ("margin" in q and "customer" in q):
-            return f"""
+            sql = f"""
                 SELECT c.CompanyName AS customer,
                        SUM(od.UnitPrice * 0.3 * od.Quantity * (1 - od.Discount)) AS margin
                 FROM "Order Details" od
@@ -293,24 +460,26 @@ class HybridAgent:
                 ORDER BY margin DESC
                 LIMIT 1;
             """.strip()
+            return GeneratedSQL(sql, where_params, ["Customers", "Order Details", "Orders"])
 
-        return ""
+        return GeneratedSQL()
 
-    def _build_filters(self, constraints: Dict[str, Any]) -> Tuple[str, str]:
+    def _build_filters(self, dr: Optional[Dict[str, str]]) -> Tuple[str, Tuple[Any, ...]]:
         where_parts = []
-        date_clause = ""
-        dr = self._get_sql_date_range(constraints)
+        params: List[Any] = []
         if dr:
-            date_clause = f"DATE(o.OrderDate) BETWEEN '{dr['start']}' AND '{dr['end']}'"
-            where_parts.append(date_clause)
+            where_parts.append("DATE(o.OrderDate) BETWEEN ? AND ?")
+            params.extend([dr["start"], dr["end"]])
         where_sql = f"WHERE {' AND '.join(where_parts)}" if where_parts else ""
-        return date_clause, where_sql
+        return where_sql, tuple(params)
 
-    def execute_sql(self, sql: str, attempt: int = 0) -> Tuple[str, Dict[str, Any]]:
+    def execute_sql(
+        self, sql: str, params: Tuple[Any, ...] = (), attempt: int = 0
+    ) -> Tuple[str, Dict[str, Any]]:
         if not sql.strip():
             return "", {"success": True, "rows": [], "columns": [], "error": None}
 
-        result = self.sqlite.execute(sql)
+        result = self.sqlite.execute(sql, params)
         if result["success"]:
             return sql, result
 
@@ -321,7 +490,7 @@ class HybridAgent:
         if repaired_sql == sql:
             return sql, result
 
-        repaired_result = self.sqlite.execute(repaired_sql)
+        repaired_result = self.sqlite.execute(repaired_sql, params)
         if repaired_result["success"]:
             return repaired_sql, repaired_result
 
@@ -331,7 +500,7 @@ class HybridAgent:
         if '"Order Details"' not in sql:
             sql = sql.replace("Order Details", '"Order Details"')
         sql = sql.replace("\n", " ")
-        sql = re.sub(r"\s+", " ", sql).strip()
+        sql = _WS_RE.sub(" ", sql).strip()
         if not sql.endswith(";"):
             sql += ";"
         return sql
@@ -344,90 +513,97 @@ class HybridAgent:
         route: str,
         sql: str,
         sql_res: Dict[str, Any],
-        chunks: List[Dict[str, Any]],
+        chunks: ChunkBundle,
         constraints: Dict[str, Any],
+        sql_tables: Optional[List[str]] = None,
+        sql_params: Tuple[Any, ...] = (),
     ) -> Dict[str, Any]:
         parsed_hint = parse_format_hint(format_hint)
-        rows = sql_res.get("rows", [])
-        success = sql_res.get("success", True)
+        if route == "rag":
+            final_answer, confidence, explanation = self._synthesize_rag(question, parsed_hint, chunks)
+        elif route == "sql":
+            final_answer, confidence, explanation = self._synthesize_sql(parsed_hint, sql_res)
+        else:
+            final_answer, confidence, explanation = self._synthesize_hybrid(question, parsed_hint, sql_res, chunks)
 
-        final_answer = None
-        confidence = 0.4
-        explanation = ""
+        citations = self._build_citations(sql, chunks, sql_tables)
+        return {
+            "id": item_id,
+            "final_answer": final_answer,
+            "sql": render_sql(sql, sql_params),
+            "confidence": round(confidence, 2),
+            "explanation": explanation,
+            "citations": citations,
+        }
 
+    def _synthesize_rag(
+        self, question: str, parsed_hint: Mapping[str, Any], chunks: ChunkBundle
+    ) -> Tuple[Any, float, str]:
+        if parsed_hint["type"] == "int":
+            return self._policy_answer(extract_policy_number(question, chunks))
+        return self._answer_from_rows(parsed_hint, [], True)
+
+    def _synthesize_sql(self, parsed_hint: Mapping[str, Any], sql_res: Dict[str, Any]) -> Tuple[Any, float, str]:
+        return self._answer_from_rows(parsed_hint, sql_res.get("rows", []), sql_res.get("success", True))
+
+    def _synthesize_hybrid(
+        self,
+        question: str,
+        parsed_hint: Mapping[str, Any],
+        sql_res: Dict[str, Any],
+        chunks: ChunkBundle,
+    ) -> Tuple[Any, float, str]:
         if parsed_hint["type"] == "int":
             value = extract_policy_number(question, chunks)
-            if value is None and rows:
-                value = int(list(rows[0].values())[0])
-            final_answer = value if value is not None else 0
-            confidence = 0.85 if value is not None else 0.4
-            explanation = "Matched return window from policy docs."
+            if value is not None:
+                return self._policy_answer(value)
+        return self._synthesize_sql(parsed_hint, sql_res)
+
+    def _policy_answer(self, value: Optional[int]) -> Tuple[Any, float, str]:
+        final_answer = value if value is not None else 0
+        confidence = 0.85 if value is not None else 0.4
+        return final_answer, confidence, "Matched return window from policy docs."
+
+    def _answer_from_rows(
+        self, parsed_hint: Mapping[str, Any], rows: List[Dict[str, Any]], success: bool
+    ) -> Tuple[Any, float, str]:
+        if parsed_hint["type"] == "int":
+            return self._policy_answer(int(list(rows[0].values())[0]) if rows else None)
 
-        elif parsed_hint["type"] == "float":
+        if parsed_hint["type"] == "float":
             numeric = None
             if rows:
                 numeric = safe_round_float(list(rows[0].values())[0], 2)
             final_answer = numeric if numeric is not None else 0.0
             confidence = 0.9 if success and rows else 0.5
-            explanation = "Computed metric via SQL over Orders/Order Details."
+            return final_answer, confidence, "Computed metric via SQL over Orders/Order Details."
 
-        elif parsed_hint["type"] == "list":
+        if parsed_hint["type"] == "list":
             out = []
-            for row in rows:
-                formatted_row = {}
-                for key, value in row.items():
-                    key_norm = key.lower()
-                    if isinstance(value, float):
-                        formatted_row[key_norm] = safe_round_float(value, 2)
-                    elif isinstance(value, int):
-                        formatted_row[key_norm] = int(value)
-                    else:
-                        formatted_row[key_norm] = value
-                out.append(formatted_row)
-            final_answer = out
+            if rows:
+                specs = build_row_formatter(rows[0])
+                out = [{key_norm: fmt(row[key]) for key, key_norm, fmt in specs} for row in rows]
             confidence = 0.9 if out else 0.5
-            explanation = "Ranked entities using revenue aggregation."
+            return out, confidence, "Ranked entities using revenue aggregation."
 
-        elif parsed_hint["type"] == "object":
+        if parsed_hint["type"] == "object":
             if rows:
-                formatted = {}
-                for key, value in rows[0].items():
-                    key_norm = key.lower()
-                    if isinstance(value, float):
-                        formatted[key_norm] = safe_round_float(value, 2)
-                    elif isinstance(value, int):
-                        formatted[key_norm] = int(value)
-                    else:
-                        formatted[key_norm] = value
-                final_answer = formatted
+                row = rows[0]
+                final_answer = {key_norm: fmt(row[key]) for key, key_norm, fmt in build_row_formatter(row)}
             else:
                 final_answer = {}
             confidence = 0.9 if rows else 0.5
-            explanation = "Derived structured answer from SQL results."
+            return final_answer, confidence, "Derived structured answer from SQL results."
 
-        else:
-            final_answer = rows[0] if rows else ""
-            confidence = 0.5
-            explanation = "Returned raw SQL output."
+        return (rows[0] if rows else ""), 0.5, "Returned raw SQL output."
 
-        citations = self._build_citations(sql, chunks)
-        return {
-            "id": item_id,
-            "final_answer": final_answer,
-            "sql": sql,
-            "confidence": round(confidence, 2),
-            "explanation": explanation,
-            "citations": citations,
-        }
-
-    def _build_citations(self, sql: str, chunks: List[Dict[str, Any]]) -> List[str]:
+    def _build_citations(
+        self, sql: str, chunks: ChunkBundle, sql_tables: Optional[List[str]] = None
+    ) -> List[str]:
         citations = []
-        for table in extract_tables_from_sql(sql):
-            citations.append(table)
-        for chunk in chunks:
-            chunk_id = chunk.get("chunk_id")
-            if chunk_id:
-                citations.append(chunk_id)
+        if sql:
+            citations.extend(sql_tables or extract_tables_from_sql(sql))
+        citations.extend(chunk_id for chunk_id in chunks.ids if chunk_id)
         return citations
 
     def _compute_year_offset(self) -> int:
@@ -438,25 +614,25 @@ class HybridAgent:
         start = rows[0].get("start_year")
         if not start:
             return 0
-        try:
-            actual_year = datetime.strptime(start, "%Y-%m-%d").year
-        except ValueError:
-            actual_year = int(str(start)[:4])
+        actual_year = int(str(start)[:4])
         expected_year = 1996
         return actual_year - expected_year
 
     def _shift_date(self, date_str: str) -> str:
         if not self.year_offset:
             return date_str
-        dt = datetime.strptime(date_str, "%Y-%m-%d")
-        dt = dt.replace(year=dt.year + self.year_offset)
-        return dt.strftime("%Y-%m-%d")
+        return f"{int(date_str[:4]) + self.year_offset:04d}{date_str[4:]}"
 
     def _get_sql_date_range(self, constraints: Dict[str, Any]) -> Optional[Dict[str, str]]:
         dr = constraints.get("date_range")
         if not dr:
             return None
-        return {
-            "start": self._shift_date(dr["start"]),
-            "end": self._shift_date(dr["end"]),
-        }
\ No newline at end of file
+        key = (dr["start"], dr["end"])
+        shifted = self._shifted_ranges.get(key)
+        if shifted is None:
+            shifted = {
+                "start": self._shift_date(dr["start"]),
+                "end": self._shift_date(dr["end"]),
+            }
+            self._shifted_ranges[key] = shifted
+        return shifted
\ No newline at end of file
@@ -1,21 +1,56 @@
+import asyncio
+import atexit
 from dataclasses import dataclass
-import json
-from typing import Any
+import functools
+import threading
+from typing import Any, BinaryIO, List, Optional
 
+import orjson
+from langchain_core.runnables import RunnableLambda
 from langgraph.constants import END
 from langgraph.graph import StateGraph
 
 from agent.rag.retrieval import Retriever
-from agent.graph_hybrid import HybridAgent
+from agent.graph_hybrid import ChunkBundle, HybridAgent
 from agent.tools.sqlite_tool import SQLiteTool
 from agent.dspy_signatures import RouterModule
 
 
-router_module = RouterModule()
-retriever = Retriever(docs_path="docs")
-retriever.load_corpus()
-sqlite_tool = SQLiteTool(db_path="data/northwind.sqlite")
-agent = HybridAgent(router_module=router_module, retriever=retriever, sqlite_tool=sqlite_tool)
+_agent_lock = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _build_agent() -> HybridAgent:
+    router_module = RouterModule()
+    retriever = Retriever(docs_path="docs")
+    retriever.load_corpus()
+    sqlite_tool = SQLiteTool(db_path="data/northwind.sqlite")
+    sqlite_tool.connect()
+    atexit.register(sqlite_tool.close)
+    return HybridAgent(router_module=router_module, retriever=retriever, sqlite_tool=sqlite_tool)
+
+
+def _get_agent() -> HybridAgent:
+    with _agent_lock:
+        return _build_agent()
+
+
+def get_agent() -> HybridAgent:
+    """Return the shared agent, building it (router compile, corpus load) on first use."""
+    return _get_agent()
+
+
+TRACE_PATH = "trace.jsonl"
+_trace_lock = threading.Lock()
+_trace_fp: Optional[BinaryIO] = None
+
+
+def _trace_file() -> BinaryIO:
+    global _trace_fp
+    if _trace_fp is None:
+        _trace_fp = open(TRACE_PATH, "ab", buffering=1 << 16)
+        atexit.register(_trace_fp.close)
+    return _trace_fp
 
 
 @dataclass
@@ -24,64 +59,65 @@ class AgentState:
     question: str = ""
     format_hint: str = ""
     route: str = ""
-    retrieved_chunks: list = None
+    route_fallback: bool = False
+    retrieved_chunks: ChunkBundle = None
     constraints: dict = None
     sql: str = ""
+    sql_params: tuple = ()
+    sql_tables: list = None
     sql_res: dict = None
     final_answer: Any = None
     confidence: float = 0.0
     explanation: str = ""
     citations: list = None
-    tables: list = None
-    table_schemas: dict = None
     repairs: int = 0
     max_repairs: int = 2
     needs_repair: bool = False
     validation_error: str = ""
 
     def __post_init__(self):
-        self.retrieved_chunks = self.retrieved_chunks or []
+        self.retrieved_chunks = self.retrieved_chunks or ChunkBundle()
         self.constraints = self.constraints or {}
         self.sql_res = self.sql_res or {"success": True, "rows": []}
         self.citations = self.citations or []
-        self.tables = self.tables or []
-        self.table_schemas = self.table_schemas or {}
+        self.sql_tables = self.sql_tables or []
 
 
 def node_router(state: AgentState) -> dict:
-    route = agent.route(state.question)
-    return {"route": route}
+    route, route_fallback = _get_agent().resolve_route(state.question)
+    return {"route": route, "route_fallback": route_fallback}
 
 
 def node_retriever(state: AgentState) -> dict:
-    chunks = agent.retrieve(state.question, top_k=10)
+    chunks = _get_agent().retrieve(state.question, top_k=10)
     return {
         "retrieved_chunks": chunks,
     }
 
 
-def node_planner(state: AgentState) -> dict:
-    constraints = agent.plan(state.question, state.retrieved_chunks)
-    return {"constraints": constraints}
+async def anode_retriever(state: AgentState) -> dict:
+    return await asyncio.to_thread(node_retriever, state)
 
 
-def node_schema(state: AgentState) -> dict:
-    return {
-        "tables": agent.artifacts.tables,
-        "table_schemas": agent.artifacts.table_schemas,
-    }
+def node_planner(state: AgentState) -> dict:
+    constraints = _get_agent().plan(state.question, state.retrieved_chunks)
+    return {"constraints": constraints}
 
 
 def node_nl2sql(state: AgentState) -> dict:
-    sql = agent.generate_sql(state.question, state.constraints)
-    return {"sql": sql}
+    generated = _get_agent().generate_sql(state.question, state.constraints)
+    return {"sql": generated.sql, "sql_params": generated.params, "sql_tables": generated.tables}
 
 
 def node_executor(state: AgentState) -> dict:
-    executed_sql, sql_res = agent.execute_sql(state.sql, attempt=state.repairs)
+    executed_sql, sql_res = _get_agent().execute_sql(state.sql, state.sql_params, attempt=state.repairs)
     return {"sql": executed_sql, "sql_res": sql_res}
 
 
+async def anode_executor(state: AgentState) -> dict:
+    return await asyncio.to_thread(node_executor, state)
+
+
 def node_validator(state: AgentState) -> dict:
     outcome = "synthesize"
     needs_repair = False
@@ -113,16 +149,18 @@ def node_repair(state: AgentState) -> dict:
         updated_constraints.pop("date_range")
     elif state.repairs == 1 and updated_constraints.get("category"):
         updated_constraints.pop("category")
-    sql = agent.generate_sql(state.question, updated_constraints)
+    generated = _get_agent().generate_sql(state.question, updated_constraints)
     return {
         "constraints": updated_constraints,
-        "sql": sql,
+        "sql": generated.sql,
+        "sql_params": generated.params,
+        "sql_tables": generated.tables,
         "repairs": state.repairs + 1,
     }
 
 
 def node_synthesizer(state: AgentState) -> dict:
-    out = agent.synthesize(
+    out = _get_agent().synthesize(
         item_id=state.item_id,
         question=state.question,
         format_hint=state.format_hint,
@@ -131,6 +169,8 @@ def node_synthesizer(state: AgentState) -> dict:
         sql_res=state.sql_res,
         chunks=state.retrieved_chunks,
         constraints=state.constraints,
+        sql_tables=state.sql_tables,
+        sql_params=state.sql_params,
     )
     return out
 
@@ -140,15 +180,17 @@ def node_trace(state: AgentState) -> dict:
         "item_id": getattr(state, "item_id", ""),
         "question": state.question,
         "route": state.route,
+        "route_fallback": state.route_fallback,
         "constraints": state.constraints,
         "sql": state.sql,
+        "sql_params": list(state.sql_params),
         "sql_success": state.sql_res.get("success", True),
         "repairs": state.repairs,
         "needs_repair": getattr(state, "needs_repair", False),
     }
-    with open("trace.jsonl", "a", encoding="utf-8") as f:
-        json.dump(log_entry, f, ensure_ascii=False)
-        f.write("\n")
+    line = orjson.dumps(log_entry) + b"\n"
+    with _trace_lock:
+        _trace_file().write(line)
     return {}
 
 
@@ -166,11 +208,10 @@ def build_graph() -> StateGraph:
     graph = StateGraph(AgentState)
 
     graph.add_node("router", node_router)
-    graph.add_node("retriever", node_retriever)
+    graph.add_node("retriever", RunnableLambda(node_retriever, afunc=anode_retriever))
     graph.add_node("planner", node_planner)
-    graph.add_node("schema", node_schema)
     graph.add_node("nl2sql", node_nl2sql)
-    graph.add_node("executor", node_executor)
+    graph.add_node("executor", RunnableLambda(node_executor, afunc=anode_executor))
     graph.add_node("validator", node_validator)
     graph.add_node("repair", node_repair)
     graph.add_node("synthesizer", node_synthesizer)
@@ -184,11 +225,10 @@ def build_graph() -> StateGraph:
         planner_branch,
         {
             "rag": "synthesizer",
-            "sql": "schema",
+            "sql": "nl2sql",
         },
     )
 
-    graph.add_edge("schema", "nl2sql")
     graph.add_edge("nl2sql", "executor")
     graph.add_edge("executor", "validator")
 
@@ -207,4 +247,9 @@ def build_graph() -> StateGraph:
 
     graph.set_entry_point("router")
 
-    return graph.compile()
\ No newline at end of file
+    return graph.compile()
+
+
+async def run_batch(states: List[AgentState], max_concurrency: int = 8) -> List[dict]:
+    compiled = build_graph()
+    return await compiled.abatch(states, config={"max_concurrency": max_concurrency})
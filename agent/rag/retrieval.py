@@ -1,39 +1,123 @@
+import hashlib
+import itertools
+import mmap
 import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import List, Dict, Tuple
 from pathlib import Path
 
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
+import joblib
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.pipeline import Pipeline
 import numpy as np
 
 
+EMBED_CACHE_SIZE = 2048
+INDEX_CACHE_VERSION = 4
+HASH_FEATURES = 2 ** 18
+INGEST_THREADS = 8
+_SPLIT_RE = re.compile(rb"(?:\r\n|\r(?!\n)|\n){2,}")
+
+
+def _decode_chunk(raw: bytes) -> str:
+    text = raw.decode("utf-8")
+    if "\r" in text:
+        # match the universal-newline translation of a text-mode read
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text.strip()
+
+
 class Retriever:
-    def __init__(self, docs_path: str = "docs", min_chunk_len: int = 20):
+    def __init__(
+        self,
+        docs_path: str = "docs",
+        min_chunk_len: int = 20,
+        cache_path: str = ".rag_cache.joblib",
+    ):
         self.docs_path = Path(docs_path)
         self.min_chunk_len = min_chunk_len
+        self.cache_path = Path(cache_path)
 
         self.chunks: List[str] = []
         self.chunk_meta: List[Dict] = []
-        self.vectorizer: TfidfVectorizer = None
+        self._id_to_idx: Dict[str, int] = {}
+        self.vectorizer: Pipeline = None
         self.tfidf_matrix = None
+        self._seen_features = None
+        self._ids_arr = None
+        self._src_arr = None
+        self._chunks_arr = None
+        self._embed_cache: Dict[str, object] = {}
+        self._embed_lock = threading.Lock()
 
-    def _chunk_file(self, filename: Path) -> List[str]:
-        text = filename.read_text(encoding="utf-8")
-        text = text.replace("\r\n", "\n").replace("\r", "\n")
-        raw_chunks = [p.strip() for p in text.split("\n\n") if p.strip()]
-        chunks = [c for c in raw_chunks if len(c) >= self.min_chunk_len]
-        return chunks
+    def _chunk_file(self, entry: os.DirEntry) -> List[str]:
+        if entry.stat().st_size == 0:
+            return []
+        with open(entry, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            parts = _SPLIT_RE.split(mm)
+        chunks = (_decode_chunk(p) for p in parts)
+        return [c for c in chunks if c and len(c) >= self.min_chunk_len]
+
+    def _list_markdown(self) -> List[os.DirEntry]:
+        # DirEntry caches its stat() result, so the cache key costs no extra syscalls
+        with os.scandir(self.docs_path) as it:
+            return sorted((e for e in it if e.name.endswith(".md") and e.is_file()), key=lambda e: e.name)
+
+    def _corpus_key(self, md_files: List[os.DirEntry]) -> str:
+        stats = [(e.name, e.stat().st_mtime_ns, e.stat().st_size) for e in md_files]
+        return hashlib.sha1(repr((INDEX_CACHE_VERSION, self.min_chunk_len, stats)).encode()).hexdigest()
+
+    def _load_cached_index(self, key: str) -> bool:
+        if not self.cache_path.exists():
+            return False
+        try:
+            cached = joblib.load(self.cache_path)
+        except Exception:
+            return False
+        if not isinstance(cached, dict) or cached.get("key") != key:
+            return False
+        self.vectorizer = cached["vec"]
+        self.tfidf_matrix = cached["mat"]
+        self.chunks = cached["chunks"]
+        self.chunk_meta = cached["meta"]
+        return True
+
+    def _save_cached_index(self, key: str):
+        payload = {
+            "vec": self.vectorizer,
+            "mat": self.tfidf_matrix,
+            "chunks": self.chunks,
+            "meta": self.chunk_meta,
+            "key": key,
+        }
+        try:
+            joblib.dump(payload, self.cache_path, compress=3)
+        except OSError:
+            pass
 
     def load_corpus(self):
         if not self.docs_path.exists():
             raise FileNotFoundError(f"Docs folder not found at {self.docs_path}")
+        md_files = self._list_markdown()
+        key = self._corpus_key(md_files)
+        self._embed_cache = {}
+        if self._load_cached_index(key):
+            self._id_to_idx = {meta["chunk_id"]: idx for idx, meta in enumerate(self.chunk_meta)}
+            self._mark_seen_features()
+            self._build_result_arrays()
+            return
+
         self.chunks = []
         self.chunk_meta = []
+        self._id_to_idx = {}
+
+        with ThreadPoolExecutor(max_workers=INGEST_THREADS) as pool:
+            per_file = list(pool.map(self._chunk_file, md_files))
 
-        md_files = sorted([p for p in self.docs_path.glob("*.md")])
         chunk_counter = 0
-        for md in md_files:
-            chunks = self._chunk_file(md)
+        for md, chunks in zip(md_files, per_file):
             for i, c in enumerate(chunks):
                 chunk_id = f"{md.name}::chunk_{i}"
                 self.chunks.append(c)
@@ -42,36 +126,88 @@ class Retriever:
                     "source": md.name,
                     "index_in_file": i,
                 })
+                self._id_to_idx[chunk_id] = len(self.chunks) - 1
                 chunk_counter += 1
 
         if len(self.chunks) == 0:
             raise ValueError(f"No chunks found in {self.docs_path} - check files and min_chunk_len")
 
-        self.vectorizer = TfidfVectorizer(stop_words="english", max_features=8000)
+        self.vectorizer = Pipeline([
+            ("hash", HashingVectorizer(
+                stop_words="english",
+                n_features=HASH_FEATURES,
+                alternate_sign=False,
+                norm=None,
+                dtype=np.float32,
+            )),
+            ("tfidf", TfidfTransformer()),
+        ])
         self.tfidf_matrix = self.vectorizer.fit_transform(self.chunks)
+        self._mark_seen_features()
+        self._build_result_arrays()
+        self._save_cached_index(key)
+
+    def _mark_seen_features(self):
+        # Query terms that never occur in the corpus hash into empty buckets;
+        # dropping them keeps query norms (and scores) vocabulary-bound.
+        self._seen_features = np.zeros(HASH_FEATURES, dtype=bool)
+        self._seen_features[self.tfidf_matrix.indices] = True
+
+    def _build_result_arrays(self):
+        # object arrays let search gather a whole top-k with one fancy index
+        self._ids_arr = np.array([m["chunk_id"] for m in self.chunk_meta], dtype=object)
+        self._src_arr = np.array([m["source"] for m in self.chunk_meta], dtype=object)
+        self._chunks_arr = np.empty(len(self.chunks), dtype=object)
+        self._chunks_arr[:] = self.chunks
+
+    def embed_query(self, query: str):
+        if self.vectorizer is None:
+            raise RuntimeError("Corpus not loaded. Call load_corpus() first.")
+        q_vec = self._embed_cache.get(query)
+        if q_vec is None:
+            counts = self.vectorizer.named_steps["hash"].transform([query])
+            counts.data[~self._seen_features[counts.indices]] = 0
+            counts.eliminate_zeros()
+            q_vec = self.vectorizer.named_steps["tfidf"].transform(counts)
+            with self._embed_lock:
+                if len(self._embed_cache) >= EMBED_CACHE_SIZE:
+                    self._embed_cache.pop(next(iter(self._embed_cache)))
+                self._embed_cache[query] = q_vec
+        return q_vec
 
     def search(self, query: str, top_k: int = 5) -> List[Dict]:
         if self.tfidf_matrix is None:
             raise RuntimeError("Corpus not loaded. Call load_corpus() first.")
 
-        q_vec = self.vectorizer.transform([query])
-        sims = linear_kernel(q_vec, self.tfidf_matrix).flatten()
-        if np.all(sims == 0):
+        q_vec = self.embed_query(query)
+        prod = (self.tfidf_matrix @ q_vec.T).tocoo()
+        if prod.nnz == 0:
             return []
 
-        top_idx = np.argsort(-sims)[:top_k]
-        results = []
-        for idx in top_idx:
-            results.append({
-                "chunk_id": self.chunk_meta[idx]["chunk_id"],
-                "source": self.chunk_meta[idx]["source"],
-                "content": self.chunks[idx],
-                "score": float(sims[idx])
-            })
-        return results
+        k = min(top_k, prod.nnz)
+        order = np.argpartition(-prod.data, k - 1)[:k]
+        order = order[np.argsort(-prod.data[order])]
+        top_idx = prod.row[order]
+        scores = prod.data[order].tolist()
+        if len(scores) < top_k:
+            matched = set(prod.row.tolist())
+            unmatched = (idx for idx in range(len(self.chunks)) if idx not in matched)
+            padding = list(itertools.islice(unmatched, top_k - len(scores)))
+            top_idx = np.concatenate([top_idx, np.array(padding, dtype=top_idx.dtype)])
+            scores.extend([0.0] * len(padding))
+
+        return [
+            {"chunk_id": chunk_id, "source": source, "content": content, "score": score}
+            for chunk_id, source, content, score in zip(
+                self._ids_arr[top_idx].tolist(),
+                self._src_arr[top_idx].tolist(),
+                self._chunks_arr[top_idx].tolist(),
+                scores,
+            )
+        ]
 
     def get_chunk(self, chunk_id: str) -> Dict:
-        for meta, content in zip(self.chunk_meta, self.chunks):
-            if meta["chunk_id"] == chunk_id:
-                return {"chunk_id": meta["chunk_id"], "source": meta["source"], "content": content}
-        raise KeyError(f"Chunk id not found: {chunk_id}")
+        idx = self._id_to_idx.get(chunk_id)
+        if idx is None:
+            raise KeyError(f"Chunk id not found: {chunk_id}")
+        return {"chunk_id": chunk_id, "source": self.chunk_meta[idx]["source"], "content": self.chunks[idx]}
@@ -1,16 +1,39 @@
 import sqlite3
-from typing import Optional, Dict, Any, List, Tuple
+import threading
+from typing import Optional, Dict, Any, List, Sequence
+
+
+READ_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL;",
+    "PRAGMA temp_store = MEMORY;",
+    "PRAGMA cache_size = -65536;",
+    "PRAGMA mmap_size = 268435456;",
+    "PRAGMA query_only = ON;",
+)
+COLUMN_CACHE_SIZE = 128
 
 
 class SQLiteTool:
-    def __init__(self, db_path: str = "data/northwind.sqlite"):
+    def __init__(self, db_path: str = "data/northwind.sqlite", cached_statements: int = 256):
         self.db_path = db_path
+        self.cached_statements = cached_statements
         self.conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._json_columns: Dict[str, List[str]] = {}
 
     def connect(self):
         if self.conn is None:
-            self.conn = sqlite3.connect(self.db_path)
-            self.conn.row_factory = sqlite3.Row
+            self.conn = sqlite3.connect(
+                self.db_path,
+                cached_statements=self.cached_statements,
+                check_same_thread=False,
+                isolation_level=None,
+            )
+            for pragma in READ_PRAGMAS:
+                try:
+                    self.conn.execute(pragma)
+                except sqlite3.Error:
+                    pass
 
     def close(self):
         if self.conn:
@@ -19,27 +42,30 @@ class SQLiteTool:
 
     def list_tables(self) -> List[str]:
         self.connect()
-        cursor = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        return [row["name"] for row in cursor.fetchall()]
+        with self._lock:
+            cursor = self.conn.execute("SELECT name FROM sqlite_master WHERE type='table';")
+            return [row[0] for row in cursor]
 
     def get_table_schema(self, table_name: str) -> List[Dict[str, Any]]:
         self.connect()
-        cursor = self.conn.execute(f"PRAGMA table_info('{table_name}');")
-        return [dict(row) for row in cursor.fetchall()]
+        with self._lock:
+            cursor = self.conn.execute(f"PRAGMA table_info('{table_name}');")
+            cols = [c[0] for c in cursor.description]
+            return [dict(zip(cols, row)) for row in cursor]
 
-    def execute(self, sql: str) -> Dict[str, Any]:
+    def execute(self, sql: str, params: Sequence[Any] = ()) -> Dict[str, Any]:
         self.connect()
 
         try:
-            cursor = self.conn.execute(sql)
-            rows = cursor.fetchall()
-
-            rows_as_dict = [dict(row) for row in rows]
+            with self._lock:
+                cursor = self.conn.execute(sql, params)
+                cols = [c[0] for c in cursor.description] if cursor.description else []
+                rows_as_dict = [dict(zip(cols, row)) for row in cursor]
 
             return {
                 "success": True,
                 "error": None,
-                "columns": rows[0].keys() if rows else [],
+                "columns": cols,
                 "rows": rows_as_dict,
             }
 
@@ -51,5 +77,54 @@ class SQLiteTool:
                 "rows": []
             }
 
+    def execute_json(self, sql: str, params: Sequence[Any] = ()) -> Dict[str, Any]:
+        """Run sql and let SQLite serialize the rows into a JSON array of objects.
+
+        JSON has no binary type, so BLOB values come back as upper-case hex strings.
+        Row order follows the query's ORDER BY in practice, but SQLite does not
+        guarantee that json_group_array keeps a subquery's order; use execute()
+        when the order matters.
+        """
+        self.connect()
+        inner = sql.strip().rstrip(";")
+
+        try:
+            with self._lock:
+                cols = self._json_columns.get(inner)
+                if cols is None:
+                    probe = self.conn.execute(f"SELECT * FROM (\n{inner}\n) LIMIT 0", params)
+                    cols = [c[0] for c in probe.description]
+                    if len(self._json_columns) >= COLUMN_CACHE_SIZE:
+                        self._json_columns.pop(next(iter(self._json_columns)))
+                    self._json_columns[inner] = cols
+                pairs = ", ".join(
+                    "'{key}', CASE WHEN typeof(\"{col}\") = 'blob' THEN hex(\"{col}\") ELSE \"{col}\" END".format(
+                        key=col.replace("'", "''"), col=col.replace('"', '""')
+                    )
+                    for col in cols
+                )
+                cursor = self.conn.execute(
+                    f"SELECT json_group_array(json_object({pairs})) FROM (\n{inner}\n)", params
+                )
+                rows_json = cursor.fetchone()[0]
+
+            return {
+                "success": True,
+                "error": None,
+                "columns": cols,
+                "rows_json": rows_json,
+            }
+
+        except Exception as e:
+            return {
+                "success": False,
+                "error": str(e),
+                "columns": [],
+                "rows_json": "[]",
+            }
+
     def test_query(self):
         return self.execute("SELECT * FROM Customers LIMIT 3;")
+
+    def test_query_json(self):
+        return self.execute_json("SELECT * FROM Customers LIMIT 3;")
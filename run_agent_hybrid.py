@@ -1,47 +1,112 @@
 import argparse
-import json
+import hashlib
+import operator
+import shelve
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
 from typing import Any, Dict
 
-from agent.lang_graph import AgentState, build_graph
+import orjson
+
+from agent.graph_hybrid import HybridAgent
+from agent.lang_graph import AgentState, build_graph, get_agent
+
+RUNNER_PATH = Path(__file__).resolve()
+AGENT_DIR = RUNNER_PATH.parent / "agent"
+DATA_INPUTS = [Path("data/northwind.sqlite"), *sorted(Path("docs").glob("*.md"))]
+OUTPUT_BUFFER_SIZE = 1 << 20
+FLUSH_EVERY = 1000
+
+# The graph returns every AgentState field as a dict; AgentState itself is a dataclass.
+_CONTRACT_FIELDS = ("item_id", "final_answer", "sql", "confidence", "explanation", "citations")
+_extract_from_dict = operator.itemgetter(*_CONTRACT_FIELDS)
+_extract_from_state = operator.attrgetter(*_CONTRACT_FIELDS)
 
 
 def project_contract(result: Any) -> Dict[str, Any]:
-    data = result.__dict__ if hasattr(result, "__dict__") else result
+    extract = _extract_from_state if isinstance(result, AgentState) else _extract_from_dict
+    item_id, final_answer, sql, confidence, explanation, citations = extract(result)
     return {
-        "id": data.get("id") or data.get("item_id"),
-        "final_answer": data.get("final_answer"),
-        "sql": data.get("sql", ""),
-        "confidence": data.get("confidence", 0.0),
-        "explanation": data.get("explanation", ""),
-        "citations": data.get("citations", []),
+        "id": item_id,
+        "final_answer": final_answer,
+        "sql": sql,
+        "confidence": confidence,
+        "explanation": explanation,
+        "citations": citations,
     }
 
+
+def cache_version(agent: HybridAgent) -> str:
+    """Fingerprint the code, its data, and the loaded router program so cached answers expire with them."""
+    digest = hashlib.sha1()
+    digest.update(RUNNER_PATH.read_bytes())
+    for path in sorted(AGENT_DIR.rglob("*.py")):
+        digest.update(path.relative_to(AGENT_DIR).as_posix().encode())
+        digest.update(path.read_bytes())
+    # Routes (and their cache) are tied to this tag, so a recompiled router invalidates answers too.
+    digest.update(agent.router_module.program_tag.encode())
+    for path in DATA_INPUTS:
+        if path.exists():
+            stat = path.stat()
+            digest.update(f"{path.as_posix()}:{stat.st_mtime_ns}:{stat.st_size}".encode())
+    return digest.hexdigest()
+
+
+def cache_key(version: str, state: AgentState) -> str:
+    return hashlib.sha1(f"{version}\0{state.question}\0{state.format_hint}".encode()).hexdigest()
+
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--batch", required=True)
     parser.add_argument("--out", default="outputs_hybrid.jsonl")
+    parser.add_argument("--concurrency", type=int, default=8, help="Questions run through the graph at once")
+    parser.add_argument("--cache", default=".agent_cache", help="Shelve file for per-question results")
+    parser.add_argument("--no-cache", action="store_true", help="Always run every question through the graph")
     args = parser.parse_args()
 
     compiled = build_graph()
 
-    outputs = []
-    with open(args.batch, "r", encoding="utf-8") as f:
+    states = []
+    with open(args.batch, "rb") as f:
         for line in f:
             if not line.strip():
                 continue
-            item = json.loads(line)
-            state = AgentState(
+            item = orjson.loads(line)
+            states.append(AgentState(
                 item_id=item["id"],
                 question=item["question"],
                 format_hint=item["format_hint"],
-            )
-            result = compiled.invoke(state)
-            outputs.append(project_contract(result))
-
-    with open(args.out, "w", encoding="utf-8") as f:
-        for out in outputs:
-            json.dump(out, f, default=str)
-            f.write("\n")
+            ))
+
+    cache = {} if args.no_cache else shelve.open(args.cache)
+    version = cache_version(get_agent())
+    keys = [cache_key(version, state) for state in states]
+    try:
+        with open(args.out, "wb", buffering=OUTPUT_BUFFER_SIZE) as fout:
+            with ThreadPoolExecutor(max_workers=max(args.concurrency, 1)) as pool:
+                pending = {}
+                for key, state in zip(keys, states):
+                    if key not in cache and key not in pending:
+                        pending[key] = pool.submit(compiled.invoke, state)
+
+                answers = {}
+                for written, (key, state) in enumerate(zip(keys, states), 1):
+                    if key in pending:
+                        result = pending.pop(key).result()
+                        answers[key] = project_contract(result)
+                        # Heuristic routes mean the LM was unreachable; ask it again next run.
+                        if not result["route_fallback"]:
+                            cache[key] = answers[key]
+                    answer = answers[key] if key in answers else cache[key]
+                    out = dict(answer, id=state.item_id)
+                    fout.write(orjson.dumps(out, default=str, option=orjson.OPT_NON_STR_KEYS))
+                    fout.write(b"\n")
+                    if written % FLUSH_EVERY == 0:
+                        fout.flush()
+    finally:
+        if not args.no_cache:
+            cache.close()
 
     print(f"Done. Results written to {args.out}")
 